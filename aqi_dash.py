@@ -6,13 +6,27 @@ from bokeh.layouts import column, row
 from bokeh.palettes import Plasma256
 from bokeh.models import WMTSTileSource
 from pyproj import Transformer
-from bokeh.models import CustomJS
+from bokeh.models import CustomJS, CDSView, BooleanFilter
+from bokeh.events import RangesUpdate
+
+try:
+    import datashader as ds
+    import datashader.transfer_functions as tf
+except ImportError:
+    ds = None
+
+# Above this many points, pre-aggregate server-side when Datashader is installed
+DATASHADE_THRESHOLD = 200_000
 
 print("Loading air quality data...")
 
-# Load the dataset
+# Load the dataset (multi-threaded pyarrow parser when available)
 try:
-    df = pd.read_csv('CAQI.csv')
+    try:
+        df = pd.read_csv('CAQI.csv', engine='pyarrow', parse_dates=['timestamp'])
+    except (ImportError, ValueError):
+        # pyarrow missing, or pandas too old for engine='pyarrow'
+        df = pd.read_csv('CAQI.csv', parse_dates=['timestamp'])
     print("Dataset loaded successfully.")
 except FileNotFoundError:
     print("ERROR: CAQI.csv not found. Please ensure the file exists.")
@@ -24,30 +38,50 @@ df = df.rename(columns={'lng': 'lon'})
 df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
 df = df.dropna(subset=['timestamp'])
 
-# Create risk categories
-def categorize_aqi(aqi):
-    if aqi <= 50: return "Good"
-    elif aqi <= 100: return "Moderate"
-    elif aqi <= 150: return "Unhealthy"
-    else: return "Hazardous"
+# Create risk categories (upper bounds are inclusive)
+RISK_BINS = np.array([50, 100, 150])
+RISK_LABELS = np.array(["Good", "Moderate", "Unhealthy", "Hazardous"])
 
-df['risk'] = df['AQI Value'].apply(categorize_aqi)
+df['risk_code'] = np.searchsorted(RISK_BINS, df['AQI Value'].to_numpy(), side='left').astype(np.uint8)
+df['risk'] = RISK_LABELS[df['risk_code'].to_numpy()]
 
 # Convert coordinates
+# Build the transformer once; CRS setup is the expensive part
+_TRANSFORMER = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
+
 def wgs84_to_web_mercator(lon, lat):
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
-    x, y = transformer.transform(lon, lat)
+    x, y = _TRANSFORMER.transform(lon, lat)
     return x, y
 
-df['x'], df['y'] = wgs84_to_web_mercator(df['lon'].values, df['lat'].values)
+df['x'], df['y'] = wgs84_to_web_mercator(df['lon'].to_numpy(), df['lat'].to_numpy())
 
 # Prepare time data
 df['time_numeric'] = (df['timestamp'] - df['timestamp'].min()).dt.total_seconds()
 time_min = int(df['time_numeric'].min())
 time_max = int(df['time_numeric'].max())
 
-# Create data source
-source = ColumnDataSource(data=df)
+# Keep rows time-ordered so the slider callback can binary search the window
+df = df.sort_values('time_numeric', kind='stable').reset_index(drop=True)
+
+# Create data source, shipping only the columns the plot, hover and callbacks use
+source_columns = ['x', 'y', 'AQI Value', 'AQI Category', 'PM2.5 AQI Value', 'Ozone AQI Value',
+                  'City', 'Country', 'lat', 'lon', 'timestamp', 'risk_code', 'time_numeric']
+df_src = df[source_columns].copy()
+df_src[['x', 'y', 'AQI Value']] = df_src[['x', 'y', 'AQI Value']].astype(np.float32)
+df_src['time_numeric'] = df_src['time_numeric'].astype(np.int32)
+
+def source_data(frame):
+    # Plain column arrays, so the pandas index isn't shipped as an extra column
+    return {col: frame[col].to_numpy() for col in source_columns}
+
+# Large datasets are datashaded; their points are then sent on demand by server callbacks
+use_datashader = ds is not None and len(df_src) > DATASHADE_THRESHOLD
+source = ColumnDataSource(data=source_data(df_src.iloc[:0] if use_datashader else df_src))
+
+# Filter through a view so widget changes don't go through selection rendering
+# (booleans=None means every row is shown)
+point_filter = BooleanFilter(booleans=None)
+view = CDSView(filter=point_filter)
 
 # Set up the plot
 p = figure(
@@ -56,7 +90,8 @@ p = figure(
     tools="pan,wheel_zoom,box_zoom,reset,save",
     title="Global Air Quality Monitoring Dashboard",
     width=1000,
-    height=600
+    height=600,
+    output_backend="webgl"
 )
 p.add_tile(WMTSTileSource(url='https://tiles.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png'))
 
@@ -68,15 +103,39 @@ choropleth_mapper = LinearColorMapper(
     nan_color='gray'
 )
 
-points = p.circle(
+# Large datasets: rasterize mean AQI onto a plot-sized image instead of drawing every point
+if use_datashader:
+    x_extent = (float(df_src['x'].min()), float(df_src['x'].max()))
+    y_extent = (float(df_src['y'].min()), float(df_src['y'].max()))
+    canvas = ds.Canvas(plot_width=p.width, plot_height=p.height,
+                       x_range=x_extent, y_range=y_extent)
+
+    def shade_aqi(frame):
+        agg = canvas.points(frame, 'x', 'y', ds.mean('AQI Value'))
+        img = tf.shade(agg, cmap=Plasma256, how='linear',
+                       span=(choropleth_mapper.low, choropleth_mapper.high))
+        return img.data
+
+    raster_source = ColumnDataSource(data={'image': [shade_aqi(df_src)]})
+    p.image_rgba(
+        image='image',
+        source=raster_source,
+        x=x_extent[0],
+        y=y_extent[0],
+        dw=x_extent[1] - x_extent[0],
+        dh=y_extent[1] - y_extent[0]
+    )
+
+points = p.scatter(
     x='x',
     y='y',
+    marker='circle',
     source=source,
+    view=view,
     size=12,
-    color={'field': 'AQI Value', 'transform': choropleth_mapper},
-    alpha=0.8,
-    line_color='white',
-    line_width=0.5,
+    fill_color={'field': 'AQI Value', 'transform': choropleth_mapper},
+    fill_alpha=0.8,
+    line_color=None,
     legend_label="AQI Intensity"
 )
 
@@ -97,7 +156,7 @@ hover = HoverTool(
     tooltips=[
         ("City", "@City"),
         ("Country", "@Country"),
-        ("AQI Value", "@{AQI Value}"),
+        ("AQI Value", "@{AQI Value}{0}"),
         ("AQI Category", "@{AQI Category}"),
         ("PM2.5", "@{PM2.5 AQI Value}"),
         ("Ozone", "@{Ozone AQI Value}"),
@@ -112,38 +171,90 @@ p.add_tools(hover)
 time_slider = Slider(start=time_min, end=time_max, value=time_min, 
                     step=3600, title="Time (seconds from start)")
 
-time_slider.js_on_change('value', CustomJS(args={'source': source}, code="""
-    const data = source.data;
-    const selected_time = cb_obj.value;
-    const time_data = data['time_numeric'];
-    const n = time_data.length;
-    
-    const new_indices = [];
-    for (let i = 0; i < n; i++) {
-        if (Math.abs(time_data[i] - selected_time) < 1800) {
-            new_indices.push(i);
-        }
-    }
-    source.selected.indices = new_indices;
-"""))
-
 # Category filter
 risk_options = ['All'] + sorted(df['risk'].unique().tolist())
 risk_filter = Select(title="Filter by Risk Level:", value="All", options=risk_options)
 
-risk_filter.js_on_change('value', CustomJS(args={'source': source}, code="""
-    const selected_risk = cb_obj.value;
-    const risk_data = source.data['risk'];
-    const n = risk_data.length;
-    
-    const new_indices = [];
-    for (let i = 0; i < n; i++) {
-        if (selected_risk === 'All' || risk_data[i] === selected_risk) {
-            new_indices.push(i);
+if use_datashader:
+    # Filter server-side: re-shade the raster from the matching rows, and
+    # once zoomed in send only the matching points inside the current viewport
+    row_mask = np.ones(len(df_src), dtype=bool)
+    full_width = x_extent[1] - x_extent[0]
+
+    def update_points():
+        x_start, x_end = p.x_range.start, p.x_range.end
+        y_start, y_end = p.y_range.start, p.y_range.end
+        if None in (x_start, x_end, y_start, y_end) or (x_end - x_start) >= full_width / 4:
+            # Zoomed out: only the raster is drawn; skip re-sending an empty source
+            if len(source.data['x']):
+                source.data = source_data(df_src.iloc[:0])
+            return
+        in_view = (row_mask
+                   & df_src['x'].between(x_start, x_end).to_numpy()
+                   & df_src['y'].between(y_start, y_end).to_numpy())
+        source.data = source_data(df_src[in_view])
+
+    def update_filters(attr, old, new):
+        # Same |t - selected| < 1800 window as the client-side filter, over sorted times
+        times = df_src['time_numeric'].to_numpy()
+        start = np.searchsorted(times, time_slider.value - 1800, side='right')
+        end = np.searchsorted(times, time_slider.value + 1800, side='left')
+        row_mask[:] = False
+        if risk_filter.value == 'All':
+            row_mask[start:end] = True
+        else:
+            selected_code = RISK_LABELS.tolist().index(risk_filter.value)
+            row_mask[start:end] = df_src['risk_code'].to_numpy()[start:end] == selected_code
+        raster_source.data = {'image': [shade_aqi(df_src[row_mask])]}
+        update_points()
+
+    time_slider.on_change('value', update_filters)
+    risk_filter.on_change('value', update_filters)
+    p.on_event(RangesUpdate, lambda event: update_points())
+else:
+    # Single filter callback for both widgets so they no longer overwrite each other
+    filter_callback = CustomJS(args={
+        'source': source,
+        'point_filter': point_filter,
+        'time_slider': time_slider,
+        'risk_filter': risk_filter,
+        'risk_labels': RISK_LABELS.tolist(),
+    }, code="""
+        const data = source.data;
+        const selected_time = time_slider.value;
+        const selected_risk = risk_filter.value;
+        const selected_code = selected_risk === 'All' ? 255 : risk_labels.indexOf(selected_risk);
+        const time_data = data['time_numeric'];  // sorted ascending
+        const risk_code = data['risk_code'];
+        const n = time_data.length;
+
+        // First index whose time satisfies pred, assuming pred is monotonic
+        function partition_point(pred) {
+            let lo = 0, hi = n;
+            while (lo < hi) {
+                const mid = (lo + hi) >>> 1;
+                if (pred(time_data[mid])) {
+                    hi = mid;
+                } else {
+                    lo = mid + 1;
+                }
+            }
+            return lo;
+        }
+
+        // Rows strictly within 1800s of the selected time form one contiguous run
+        const start = partition_point(t => t > selected_time - 1800);
+        const end = partition_point(t => t >= selected_time + 1800);
+
+        // A plain boolean Array, so the server-side BooleanFilter accepts the synced value
+        const booleans = new Array(n).fill(false);
+        for (let i = start; i < end; i++) {
+            booleans[i] = selected_code === 255 || risk_code[i] === selected_code;
         }
-    }
-    source.selected.indices = new_indices;
-"""))
+        point_filter.booleans = booleans;
+    """)
+    time_slider.js_on_change('value', filter_callback)
+    risk_filter.js_on_change('value', filter_callback)
 
 # Final layout
 layout = column(risk_filter, time_slider, p)